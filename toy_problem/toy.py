@@ -5,7 +5,6 @@ import torch
 import torchtext
 import sys
 import warnings
-import torch.nn as nn
 sys.path.append('..')
 from transformer.checkpoint.checkpoint import Checkpoint
 from transformer.dataset.field import SourceField, TargetField
@@ -98,12 +97,7 @@ if __name__ == '__main__':
         # are different from 'src' and 'tgt' respectively, they have
         # to be set explicitly before any training or inference
 
-        # Prepare loss
-        weight = torch.ones(len(tgt.vocab))
         pad_id = tgt.vocab.stoi[tgt.pad_token]
-        criterion = nn.NLLLoss(weight, pad_id)
-        if torch.cuda.is_available():
-            criterion.cuda()
 
         model = None
         optimizer = None
@@ -119,7 +113,7 @@ if __name__ == '__main__':
                 param.data.uniform_(-0.08, 0.08)
 
         # train
-        t = SupervisedTrainer(criterion=criterion, batch_size=32,
+        t = SupervisedTrainer(batch_size=32,
                               checkpoint_every=5000,
                               print_every=10, expt_dir=opt.expt_dir)
 
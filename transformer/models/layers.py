@@ -12,15 +12,16 @@ class TransformerEncoderLayer(nn.Module):
     def __init__(self, d_model: int = 512, num_heads: int = 8, d_ff: int = 2048,
                  dropout_p: float = 0.3, ffnet_style: str = 'ff') -> None:
         super(TransformerEncoderLayer, self).__init__()
-        self.self_attention = AddNorm(MultiHeadAttention(d_model, num_heads), d_model)
+        self.self_attention = AddNorm(MultiHeadAttention(d_model, num_heads, dropout_p), d_model)
         self.feed_forward = AddNorm(PoswiseFeedForwardNet(d_model, d_ff, dropout_p, ffnet_style), d_model)
 
     def forward(
-        self, 
-        inputs: Tensor, 
+        self,
+        inputs: Tensor,
         self_attn_mask: Optional[Tensor] = None,
+        need_weights: bool = False,
     ) -> Tuple[Tensor, Tensor]:
-        output, attn = self.self_attention(inputs, inputs, inputs, self_attn_mask)
+        output, attn = self.self_attention(inputs, inputs, inputs, self_attn_mask, need_weights=need_weights)
         output = self.feed_forward(output)
         return output, attn
 
@@ -33,17 +34,17 @@ class TransformerDecoderLayer(nn.Module):
     def __init__(self, d_model: int = 512, num_heads: int = 8, d_ff: int = 2048,
                  dropout_p: float = 0.3, ffnet_style: str = 'ff') -> None:
         super(TransformerDecoderLayer, self).__init__()
-        self.self_attention = AddNorm(MultiHeadAttention(d_model, num_heads), d_model)
-        self.encoder_attention = AddNorm(MultiHeadAttention(d_model, num_heads), d_model)
+        self.self_attention = AddNorm(MultiHeadAttention(d_model, num_heads, dropout_p), d_model)
+        self.memory_attention = AddNorm(MultiHeadAttention(d_model, num_heads, dropout_p), d_model)
         self.feed_forward = AddNorm(PoswiseFeedForwardNet(d_model, d_ff, dropout_p, ffnet_style), d_model)
 
     def forward(
-        self, inputs: Tensor, 
+        self, inputs: Tensor,
         memory: Tensor,
-        self_attn_mask: Tensor = None, 
-        memory_mask: Tensor = None
+        memory_mask: Tensor = None,
+        need_weights: bool = False
     ) -> Tuple[Tensor, Tensor, Tensor]:
-        output, self_attn = self.self_attention(inputs, inputs, inputs, self_attn_mask)
-        output, memory_attn = self.memory_attention(output, memory, memory, memory_mask)
+        output, self_attn = self.self_attention(inputs, inputs, inputs, is_causal=True, need_weights=need_weights)
+        output, memory_attn = self.memory_attention(output, memory, memory, memory_mask, need_weights=need_weights)
         output = self.feed_forward(output)
         return output, self_attn, memory_attn
@@ -4,10 +4,14 @@ from torch import Tensor
 
 def get_pad_mask(inputs: Tensor, input_lengths: Tensor = None, pad_id: int = None) -> Tensor:
     """
-    Padding position is set to True, either use input_lengths or pad_id
+    Padding position is set to True, either use input_lengths or pad_id.
+
+    The mask is returned in broadcastable (batch, 1, 1, seq_length) shape, so it can be
+    built once per batch and shared by every attention layer without materializing a
+    (batch, q_len, k_len) tensor per layer.
 
     Examples::
-        >>> get_pad_mask(inputs, input_lengths)
+        >>> get_pad_mask(inputs, input_lengths).squeeze()
         [[0, 0, 0, 0, 0, 0, 1, 1, 1, 1],
          [0, 0, 0, 0, 0, 1, 1, 1, 1, 1],
          [0, 0, 0, 1, 1, 1, 1, 1, 1, 1],
@@ -20,26 +24,29 @@ def get_pad_mask(inputs: Tensor, input_lengths: Tensor = None, pad_id: int = Non
          [0, 0, 0, 0, 0, 0, 1, 1, 1, 1]] x batch_size
     """
     assert (input_lengths is None and pad_id is not None) or (input_lengths is not None and pad_id is None)
+    assert inputs.dim() == 2
 
     if input_lengths is not None:
-        batch_size = inputs.size(0)
-        pad_mask = inputs.new_zeros(inputs.size()[:-1])  # N x T
-        for i in range(batch_size):
-            pad_mask[i, input_lengths[i]:] = 1
+        positions = torch.arange(inputs.size(1), device=inputs.device)
+        pad_mask = positions.unsqueeze(0) >= input_lengths.to(inputs.device).unsqueeze(1)  # B x T
 
     else:
-        assert inputs.dim() == 2
         pad_mask = inputs.eq(pad_id)
 
-    return pad_mask.unsqueeze(-1).bool()
+    return pad_mask.unsqueeze(1).unsqueeze(2)  # B x 1 x 1 x T, a strided view with no copy
+
+
+_CAUSAL_CACHE = dict()
 
 
-def get_subsequent_mask(inputs: Tensor) -> Tensor:
+def get_causal_mask(seq_length: int, device: torch.device = None) -> Tensor:
     """
-    Makes subsequent masking like following:
+    Subsequent (causal) masking, cached per (seq_length, device) since the triangle
+    is identical for every batch. The mask broadcasts over batch and head dimensions,
+    so no per-batch expansion is ever materialized.
 
     Examples::
-        >>> get_subsequent_mask(inputs)
+        >>> get_causal_mask(seq_length)
         [[0, 1, 1, 1, 1, 1, 1, 1, 1, 1],
          [0, 0, 1, 1, 1, 1, 1, 1, 1, 1],
          [0, 0, 0, 1, 1, 1, 1, 1, 1, 1],
@@ -49,20 +56,13 @@ def get_subsequent_mask(inputs: Tensor) -> Tensor:
          [0, 0, 0, 0, 0, 0, 0, 1, 1, 1],
          [0, 0, 0, 0, 0, 0, 0, 0, 1, 1],
          [0, 0, 0, 0, 0, 0, 0, 0, 0, 1],
-         [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]] x batch_size
+         [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]]
     """
+    key = (seq_length, device)
+    causal_mask = _CAUSAL_CACHE.get(key)
 
-    batch_size, seq_length = inputs.size()
-    subsequent_mask = torch.triu(torch.ones((seq_length, seq_length), device=inputs.device, dtype=torch.uint8), diagonal=1)
-    subsequent_mask = subsequent_mask.unsqueeze(0).expand(batch_size, -1, -1)  # BxTxT
-
-    return subsequent_mask.bool()
-
-
-def get_attn_pad_mask(key: Tensor, pad_id: int) -> Tensor:
-    """ For masking out the padding part of key sequence. """
-    # Expand to fit the shape of key query attention matrix.
-    attn_pad_mask = key.eq(pad_id)
-    attn_pad_mask = attn_pad_mask.unsqueeze(1).expand(-1, key.size(1), -1)  # b x lq x lk
+    if causal_mask is None:
+        causal_mask = torch.ones(seq_length, seq_length, dtype=torch.bool, device=device).triu_(1)  # TxT
+        _CAUSAL_CACHE[key] = causal_mask
 
-    return attn_pad_mask.bool()
+    return causal_mask
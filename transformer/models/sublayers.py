@@ -4,7 +4,13 @@ import torch.nn.functional as F
 import numpy as np
 from torch import Tensor
 from typing import Optional, Tuple
-from transformer.models.modules import Linear, LayerNorm
+from transformer.models.modules import Linear
+from transformer.models.mask import get_causal_mask
+
+
+@torch.compile(dynamic=True)
+def _fused_add_layer_norm(residual: Tensor, output: Tensor, weight: Tensor, bias: Tensor, eps: float) -> Tensor:
+    return F.layer_norm(output + residual, output.shape[-1:], weight, bias, eps)
 
 
 class AddNorm(nn.Module):
@@ -12,20 +18,28 @@ class AddNorm(nn.Module):
     Add & Normalization layer proposed in "Attention Is All You Need".
     Transformer employ a residual connection around each of the two sub-layers,
     (Multi-Head Attention & Feed-Forward) followed by layer normalization.
+
+    The residual add and the LayerNorm are compiled into a single fused kernel:
+    LayerNorm is memory-bound, so folding the add into it removes one full
+    read/write pass over the activation tensor.
     """
     def __init__(self, sublayer: nn.Module, d_model: int = 512) -> None:
         super(AddNorm, self).__init__()
         self.sublayer = sublayer
-        self.layer_norm = LayerNorm(d_model)
+        self.layer_norm = nn.LayerNorm(d_model, eps=1e-6)
 
-    def forward(self, *args):
+    def forward(self, *args, **kwargs):
         residual = args[0]
-        output = self.sublayer(*args)
+        output = self.sublayer(*args, **kwargs)
 
         if isinstance(output, tuple):
-            return self.layer_norm(output[0] + residual), output[1]
+            return self._add_norm(residual, output[0]), output[1]
         else:
-            return self.layer_norm(output + residual)
+            return self._add_norm(residual, output)
+
+    def _add_norm(self, residual: Tensor, output: Tensor) -> Tensor:
+        return _fused_add_layer_norm(residual, output, self.layer_norm.weight, self.layer_norm.bias,
+                                     self.layer_norm.eps)
 
 
 class ScaledDotProductAttention(nn.Module):
@@ -34,6 +48,10 @@ class ScaledDotProductAttention(nn.Module):
     Compute the dot products of the query with all keys, divide each by sqrt(dim),
     and apply a softmax function to obtain the weights on the values
 
+    This explicit implementation materializes the full attention matrix and only
+    serves as the fallback when the caller asks for the attention weights; the
+    hot path goes through the fused `F.scaled_dot_product_attention` kernel.
+
     Args: dim, mask
         dim (int): dimention of attention
         mask (torch.Tensor): tensor containing indices to be masked
@@ -53,13 +71,13 @@ class ScaledDotProductAttention(nn.Module):
         self.sqrt_dim = np.sqrt(dim)
 
     def forward(self, query: Tensor, key: Tensor, value: Tensor, mask: Optional[Tensor] = None) -> Tuple[Tensor, Tensor]:
-        score = torch.bmm(query, key.transpose(1, 2)) / self.sqrt_dim
+        score = torch.matmul(query, key.transpose(-2, -1)) / self.sqrt_dim
 
         if mask is not None:
-            score.masked_fill_(mask.view(score.size()), -float('Inf'))
+            score.masked_fill_(mask, -float('Inf'))
 
         attn = F.softmax(score, -1)
-        context = torch.bmm(attn, value)
+        context = torch.matmul(attn, value)
         return context, attn
 
 
@@ -75,9 +93,14 @@ class MultiHeadAttention(nn.Module):
     MultiHead(Q, K, V) = Concat(head_1, ..., head_h) · W_o
         where head_i = Attention(Q · W_q, K · W_k, V · W_v)
 
+    The scaled dot-product itself is computed by `F.scaled_dot_product_attention`,
+    which dispatches to a fused (FlashAttention / memory-efficient) kernel when available
+    instead of materializing the full attention matrix in memory.
+
     Args:
         d_model (int): The dimension of keys / values / quries (default: 512)
         num_heads (int): The number of attention heads. (default: 8)
+        dropout_p (float): dropout probability applied to the attention weights (default: 0.0)
 
     Inputs: query, key, value, mask
         - **query** (batch, q_len, d_model): In transformer, three different ways:
@@ -96,65 +119,110 @@ class MultiHeadAttention(nn.Module):
             Case 3: come from the output embedding (masked)
 
         - **mask** (-): tensor containing indices to be masked
+        - **is_causal** (bool): if True, the subsequent (triangular) mask is applied implicitly
+            inside the fused kernel instead of being materialized as a (batch, q_len, k_len)
+            tensor. Mutually exclusive with `mask`.
+        - **need_weights** (bool): if True, fall back to the explicit attention path and
+            return the materialized attention weights. (default: False)
 
     Returns: output, attn
         - **output** (batch, output_len, dimensions): tensor containing the attended output features.
-        - **attn** (batch * num_heads, v_len): tensor containing the attention (alignment) from the encoder outputs.
+        - **attn** (batch, num_heads, q_len, k_len): attention (alignment) weights when
+            `need_weights` is True, otherwise None: the fused kernel never materializes them.
     """
-    def __init__(self, d_model: int = 512, num_heads: int = 8) -> None:
+    def __init__(self, d_model: int = 512, num_heads: int = 8, dropout_p: float = 0.0) -> None:
         super(MultiHeadAttention, self).__init__()
 
         assert d_model % num_heads == 0, "d_model % num_heads should be zero."
 
+        self.d_model = d_model
         self.d_head = int(d_model / num_heads)
         self.num_heads = num_heads
+        self.dropout_p = dropout_p
         self.scaled_dot_attn = ScaledDotProductAttention(self.d_head)
-        self.linear_q = Linear(d_model, self.d_head * num_heads)
-        self.linear_k = Linear(d_model, self.d_head * num_heads)
-        self.linear_v = Linear(d_model, self.d_head * num_heads)
+        # The q, k and v projections are held as one (3 * d_model, d_model) weight so that
+        # self-attention issues a single large GEMM instead of three small ones; for
+        # cross-attention the q slice and the fused kv slice are applied separately.
+        self.qkv_proj = Linear(d_model, 3 * d_model)
         self.linear = Linear(d_model, d_model)
 
-    def forward(self, query: Tensor, key: Tensor, value: Tensor, mask: Optional[Tensor] = None) -> Tuple[Tensor, Tensor]:
+    def forward(self, query: Tensor, key: Tensor, value: Tensor, mask: Optional[Tensor] = None,
+                is_causal: bool = False, need_weights: bool = False) -> Tuple[Tensor, Optional[Tensor]]:
+        assert not (is_causal and mask is not None), "is_causal and mask are mutually exclusive."
         batch_size = value.size(0)
+        weight, bias = self.qkv_proj.linear.weight, self.qkv_proj.linear.bias
+
+        if key is query and value is query:
+            qkv = self.qkv_proj(query).view(batch_size, -1, 3, self.num_heads, self.d_head)
+            query, key, value = qkv.permute(2, 0, 3, 1, 4).unbind(0)  # each BxNxT_LENxD
+        elif key is value:
+            query = F.linear(query, weight[:self.d_model], bias[:self.d_model]) \
+                .view(batch_size, -1, self.num_heads, self.d_head).transpose(1, 2)              # BxNxQ_LENxD
+            kv = F.linear(key, weight[self.d_model:], bias[self.d_model:]) \
+                .view(batch_size, -1, 2, self.num_heads, self.d_head)
+            key, value = kv.permute(2, 0, 3, 1, 4).unbind(0)                                    # each BxNxK_LENxD
+        else:
+            query = F.linear(query, weight[:self.d_model], bias[:self.d_model]) \
+                .view(batch_size, -1, self.num_heads, self.d_head).transpose(1, 2)              # BxNxQ_LENxD
+            key = F.linear(key, weight[self.d_model:2 * self.d_model], bias[self.d_model:2 * self.d_model]) \
+                .view(batch_size, -1, self.num_heads, self.d_head).transpose(1, 2)              # BxNxK_LENxD
+            value = F.linear(value, weight[2 * self.d_model:], bias[2 * self.d_model:]) \
+                .view(batch_size, -1, self.num_heads, self.d_head).transpose(1, 2)              # BxNxV_LENxD
+
+        if mask is not None and mask.dim() == 3:
+            mask = mask.unsqueeze(1)  # Bx1xQ_LENxK_LEN, broadcast over heads
+
+        if need_weights:
+            if is_causal:
+                mask = get_causal_mask(query.size(2), query.device)
+            context, attn = self.scaled_dot_attn(query, key, value, mask)
+        else:
+            context = F.scaled_dot_product_attention(
+                query, key, value,
+                attn_mask=None if mask is None else ~mask,  # fused-kernel convention: True means "attend"
+                dropout_p=self.dropout_p if self.training else 0.0,
+                is_causal=is_causal,
+            )
+            attn = None
 
-        query = self.linear_q(query).view(batch_size, -1, self.num_heads, self.d_head)  # BxQ_LENxNxD
-        key = self.linear_k(key).view(batch_size, -1, self.num_heads, self.d_head)      # BxK_LENxNxD
-        value = self.linear_v(value).view(batch_size, -1, self.num_heads, self.d_head)  # BxV_LENxNxD
+        output = _fused_merge_heads_project(context, self.linear.linear.weight, self.linear.linear.bias)  # BxTxND
+        return output, attn
 
-        query = query.permute(2, 0, 1, 3).contiguous().view(batch_size * self.num_heads, -1, self.d_head)  # BNxQ_LENxD
-        key = key.permute(2, 0, 1, 3).contiguous().view(batch_size * self.num_heads, -1, self.d_head)      # BNxK_LENxD
-        value = value.permute(2, 0, 1, 3).contiguous().view(batch_size * self.num_heads, -1, self.d_head)  # BNxV_LENxD
 
-        if mask is not None:
-            mask = mask.unsqueeze(1).repeat(1, self.num_heads, 1, 1)  # BxNxQ_LENxK_LEN
+@torch.compile(dynamic=True)
+def _fused_merge_heads_project(context: Tensor, weight: Tensor, bias: Tensor) -> Tensor:
+    # (B, N, T, D) -> (B, T, N*D) -> output projection. Compiled so the layout change
+    # is absorbed into the GEMM instead of materializing a contiguous copy first.
+    batch_size = context.size(0)
+    context = context.transpose(1, 2).reshape(batch_size, -1, weight.size(1))
+    return F.linear(context, weight, bias)
 
-        context, attn = self.scaled_dot_attn(query, key, value, mask)
-        context = context.view(self.num_heads, batch_size, -1, self.d_head)
-        context = context.permute(1, 2, 0, 3).contiguous().view(batch_size, -1, self.num_heads * self.d_head)  # BxTxND
 
-        output = self.linear(context)
-        return output, attn
+@torch.compile(dynamic=True)
+def _fused_gelu_dropout(inputs: Tensor, dropout_p: float, training: bool) -> Tensor:
+    return F.dropout(F.gelu(inputs), p=dropout_p, training=training)
 
 
 class PoswiseFeedForwardNet(nn.Module):
     """
     Position-wise Feedforward Networks proposed in "Attention Is All You Need".
     Fully connected feed-forward network, which is applied to each position separately and identically.
-    This consists of two linear transformations with a ReLU activation in between.
+    This consists of two linear transformations with a GELU activation in between.
     Another way of describing this is as two convolutions with kernel size 1.
+
+    The activation and dropout between the two projections run as one compiled kernel,
+    so the (batch, length, d_ff) hidden tensor is not round-tripped through memory
+    between them.
     """
     def __init__(self, d_model: int = 512, d_ff: int = 2048,
                  dropout_p: float = 0.3, ffnet_style: str = 'feed_forward') -> None:
         super(PoswiseFeedForwardNet, self).__init__()
         self.ffnet_style = ffnet_style.lower()
+        self.dropout_p = dropout_p
         if self.ffnet_style == 'ff':
-            self.feed_forward = nn.Sequential(
-                Linear(d_model, d_ff),
-                nn.Dropout(dropout_p),
-                nn.ReLU(),
-                Linear(d_ff, d_model),
-                nn.Dropout(dropout_p)
-            )
+            self.linear1 = Linear(d_model, d_ff)
+            self.linear2 = Linear(d_ff, d_model)
+            self.output_dropout = nn.Dropout(dropout_p)
 
         elif self.ffnet_style == 'conv':
             self.conv1 = nn.Conv1d(in_channels=d_model, out_channels=d_ff, kernel_size=1)
@@ -162,11 +230,12 @@ class PoswiseFeedForwardNet(nn.Module):
             self.conv2 = nn.Conv1d(in_channels=d_ff, out_channels=d_model, kernel_size=1)
 
         else:
-            raise ValueError("Unsupported mode: {0}".format(self.mode))
+            raise ValueError("Unsupported ffnet_style: {0}".format(self.ffnet_style))
 
     def forward(self, inputs: Tensor) -> Tensor:
         if self.ffnet_style == 'ff':
-            output = self.feed_forward(inputs)
+            output = _fused_gelu_dropout(self.linear1(inputs), self.dropout_p, self.training)
+            output = self.output_dropout(self.linear2(output))
 
         else:
             output = self.conv1(inputs.transpose(1, 2))
@@ -9,12 +9,11 @@ Reference :
     - **https://github.com/jadore801120/attention-is-all-you-need-pytorch**
     - **https://github.com/JayParks/transformer**
 """
+import torch
 import torch.nn as nn
 from torch import Tensor
 from typing import Optional, Tuple
-from transformer.models.modules import Linear
-from transformer.models.mask import subsequent_masking, pad_masking, get_pad_mask, get_attn_pad_mask, \
-    get_subsequent_mask
+from transformer.models.mask import get_pad_mask, get_causal_mask
 from transformer.models.embeddings import Embedding, PositionalEncoding
 from transformer.models.layers import TransformerEncoderLayer, TransformerDecoderLayer
 
@@ -37,6 +36,17 @@ class Transformer(nn.Module):
         dropout_p (float): dropout probability (default: 0.3)
         ffnet_style (str): if poswise_ffnet is 'ff', position-wise feed forware network to be a feed forward,
             otherwise, position-wise feed forward network to be a convolution layer. (default: ff)
+        use_autocast (bool): if True, run the encoder and decoder stacks under bfloat16 autocast
+            so the attention and feed-forward GEMMs use tensor cores; the generator projection
+            stays in float32 for a numerically stable softmax. (default: True)
+        native_layers (bool): if True, build the stacks from torch.nn.TransformerEncoder /
+            TransformerDecoder, whose BetterTransformer fast path converts padding-heavy
+            batches to nested tensors and skips computation on pad tokens. The native stack
+            cannot return attention weights. (default: False)
+        tie_embeddings (bool): if True, share one token-embedding matrix between the encoder
+            and decoder and tie the generator projection to it, as in the original paper.
+            Only enable for a genuinely shared source/target vocabulary; the vocabulary and
+            generator sizes must match. (default: False)
 
     Inputs: inputs, targets
         - **inputs** (batch, input_length): tensor containing input sequences
@@ -48,24 +58,48 @@ class Transformer(nn.Module):
     def __init__(self, num_classes: int, pad_id: int, num_input_embeddings: int, num_output_embeddings: int,
                  d_model: int = 512, d_ff: int = 2048, num_heads: int = 8,
                  num_encoder_layers: int = 6, num_decoder_layers: int = 6,
-                 dropout_p: float = 0.3, ffnet_style: str = 'ff') -> None:
+                 dropout_p: float = 0.3, ffnet_style: str = 'ff', use_autocast: bool = True,
+                 native_layers: bool = False, tie_embeddings: bool = False) -> None:
         super(Transformer, self).__init__()
         self.pad_id = pad_id
+        # The BetterTransformer inference fast path brings its own fused kernels and
+        # rejects autocast-mixed dtypes, so autocast stays off for native stacks.
+        self.use_autocast = use_autocast and not native_layers
         self.encoder = TransformerEncoder(num_input_embeddings, d_model, d_ff, num_encoder_layers,
-                                          num_heads, ffnet_style, dropout_p, pad_id)
+                                          num_heads, ffnet_style, dropout_p, pad_id, native_layers)
         self.decoder = TransformerDecoder(num_output_embeddings, d_model, d_ff, num_decoder_layers,
-                                          num_heads, ffnet_style, dropout_p, pad_id)
-        self.generator = Linear(d_model, num_classes)
+                                          num_heads, ffnet_style, dropout_p, pad_id, native_layers)
+        # A plain nn.Linear lets torch.compile recognize the generator and fuse it with
+        # the downstream log_softmax / cross-entropy instead of treating it opaquely.
+        self.generator = nn.Linear(d_model, num_classes)
+        nn.init.xavier_uniform_(self.generator.weight)
+        nn.init.zeros_(self.generator.bias)
+
+        # The sinusoidal table is identical for both stacks, so keep a single buffer.
+        self.decoder.pos_encoding = self.encoder.pos_encoding
+
+        # Weight tying as in the original paper: one embedding matrix shared by both
+        # stacks and reused as the generator projection. Opt-in only — matching sizes
+        # alone do not imply a shared vocabulary.
+        if tie_embeddings:
+            assert num_input_embeddings == num_output_embeddings == num_classes, \
+                "tie_embeddings requires matching source/target vocabulary and generator sizes."
+            self.decoder.embedding.embedding.weight = self.encoder.embedding.embedding.weight
+            self.generator.weight = self.encoder.embedding.embedding.weight
 
     def forward(self, inputs: Tensor, input_lengths: Tensor,
                 targets: Optional[Tensor],
                 return_attns: bool = False) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
-        batch_size = targets.size(0)
-        targets = targets[targets != self.eos_id].view(batch_size, -1)
+        # Built once per batch in broadcastable (B, 1, 1, T) shape and shared by every
+        # encoder self-attention and decoder memory-attention layer.
+        src_pad_mask = get_pad_mask(inputs, input_lengths=input_lengths)
 
-        memory, encoder_self_attns = self.encoder(inputs, input_lengths)
-        output, decoder_self_attns, memory_attns = self.decoder(targets, input_lengths, memory)
-        output = self.generator(output)
+        with torch.autocast(device_type=inputs.device.type, dtype=torch.bfloat16, enabled=self.use_autocast):
+            memory, encoder_self_attns = self.encoder(inputs, src_pad_mask, return_attns=return_attns)
+            output, decoder_self_attns, memory_attns = self.decoder(targets, memory, src_pad_mask,
+                                                                    return_attns=return_attns)
+        # The generator (and the loss computed on it) stays in full precision.
+        output = self.generator(output.float())
 
         if return_attns:
             return output, encoder_self_attns, decoder_self_attns, memory_attns
@@ -73,6 +107,55 @@ class Transformer(nn.Module):
         return output
 
 
+class CUDAGraphedTransformer(nn.Module):
+    """
+    Inference wrapper that captures Transformer.forward into one CUDA graph per
+    (batch, source_length, target_length) shape bucket and replays it on subsequent
+    calls with the same shapes. Replaying collapses the dozens of per-layer kernel
+    launches of a forward pass into a single cudaGraphLaunch, which dominates
+    latency for small batches. Intended for serving with inputs padded to fixed
+    buckets; requires a CUDA device and runs the model under no_grad.
+    """
+    def __init__(self, model: Transformer, num_warmup_iters: int = 3) -> None:
+        super(CUDAGraphedTransformer, self).__init__()
+        assert torch.cuda.is_available(), "CUDA graph capture requires a CUDA device."
+        self.model = model.eval()
+        self.num_warmup_iters = num_warmup_iters
+        self.graphs = dict()
+
+    @torch.no_grad()
+    def forward(self, inputs: Tensor, input_lengths: Tensor, targets: Tensor) -> Tensor:
+        key = (inputs.size(0), inputs.size(1), targets.size(1))
+
+        if key not in self.graphs:
+            self._capture(key, inputs, input_lengths, targets)
+
+        graph, static_inputs, static_output = self.graphs[key]
+        static_inputs[0].copy_(inputs)
+        static_inputs[1].copy_(input_lengths)
+        static_inputs[2].copy_(targets)
+        graph.replay()
+
+        return static_output.clone()
+
+    def _capture(self, key, inputs: Tensor, input_lengths: Tensor, targets: Tensor) -> None:
+        static_inputs = (inputs.clone(), input_lengths.clone(), targets.clone())
+
+        # Warm up on a side stream so lazy kernel initialization is not captured.
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(self.num_warmup_iters):
+                self.model(*static_inputs)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            static_output = self.model(*static_inputs)
+
+        self.graphs[key] = (graph, static_inputs, static_output)
+
+
 class TransformerEncoder(nn.Module):
     """
     The TransformerEncoder is composed of a stack of N identical layers.
@@ -81,32 +164,62 @@ class TransformerEncoder(nn.Module):
     """
     def __init__(self, num_embeddings: int, d_model: int = 512, d_ff: int = 2048,
                  num_layers: int = 6, num_heads: int = 8, ffnet_style: str = 'ff',
-                 dropout_p: float = 0.3, pad_id: int = 0) -> None:
+                 dropout_p: float = 0.3, pad_id: int = 0, native_layers: bool = False) -> None:
         super(TransformerEncoder, self).__init__()
         self.d_model = d_model
         self.num_layers = num_layers
         self.num_heads = num_heads
         self.pad_id = pad_id
+        self.native_layers = native_layers
         self.embedding = Embedding(num_embeddings, pad_id, d_model)
-        self.pos_encoding = PositionalEncoding(d_model, dropout_p)
+        self.pos_encoding = PositionalEncoding(d_model)
         self.input_dropout = nn.Dropout(p=dropout_p)
-        self.layers = nn.ModuleList(
-            [TransformerEncoderLayer(d_model, num_heads, d_ff, dropout_p, ffnet_style) for _ in range(num_layers)]
-        )
-        self.logit_scale = (d_model ** -0.5)
+        if native_layers:
+            # torch.nn's stack dispatches to the BetterTransformer fast path; with
+            # enable_nested_tensor, padding-heavy batches are converted to nested
+            # tensors and pad tokens are skipped entirely.
+            self.layers = nn.TransformerEncoder(
+                nn.TransformerEncoderLayer(d_model, num_heads, d_ff, dropout_p,
+                                           activation='gelu', batch_first=True),
+                num_layers, enable_nested_tensor=True, mask_check=False,
+            )
+        else:
+            self.layers = nn.ModuleList(
+                [TransformerEncoderLayer(d_model, num_heads, d_ff, dropout_p, ffnet_style) for _ in range(num_layers)]
+            )
 
-    def forward(self, inputs: Tensor, input_lengths: Tensor = None) -> Tuple[Tensor, Tensor]:
-        self_attns = list()
+    @torch.compile(fullgraph=True, dynamic=True)
+    def _run_stack(self, output: Tensor, self_attn_mask: Optional[Tensor]) -> Tensor:
+        # Compiled as one graph so Inductor can fuse the residual-add / LayerNorm /
+        # activation kernels across layer boundaries and drop the per-layer dispatch cost.
+        for layer in self.layers:
+            output, _ = layer(output, self_attn_mask)
+        return output
 
-        output = self.input_dropout(self.embedding(inputs) * self.logit_scale + self.pos_encoding(inputs))
+    def forward(self, inputs: Tensor, self_attn_mask: Optional[Tensor] = None,
+                return_attns: bool = False) -> Tuple[Tensor, Tensor]:
         length = inputs.size(1)
-        self_attn_mask = get_pad_mask(inputs, input_lengths).squeeze(-1).unsqueeze(1).expand(-1, length, -1)
 
-        for layer in self.layers:
-            output, attn = layer(output, self_attn_mask)
-            self_attns.append(attn)
+        # No embedding scale to apply (see Embedding), so the prologue is a single add.
+        output = self.input_dropout(self.pos_encoding(length) + self.embedding(inputs))
+
+        if self.native_layers:
+            assert not return_attns, "the native fast-path stack does not expose attention weights."
+            key_padding_mask = None if self_attn_mask is None else self_attn_mask.reshape(inputs.size(0), length)
+            output = self.layers(output, src_key_padding_mask=key_padding_mask)
+            return output, None
+
+        if return_attns:
+            # Eager fallback: the fused attention kernel cannot expose its weights,
+            # so the attention matrices are only materialized on explicit request.
+            self_attns = list()
+            for layer in self.layers:
+                output, attn = layer(output, self_attn_mask, need_weights=True)
+                self_attns.append(attn)
+            return output, self_attns
 
-        return output, self_attns
+        output = self._run_stack(output, self_attn_mask)
+        return output, None
 
 
 class TransformerDecoder(nn.Module):
@@ -117,32 +230,60 @@ class TransformerDecoder(nn.Module):
     """
     def __init__(self, num_embeddings: int, d_model: int = 512, d_ff: int = 512,
                  num_layers: int = 6, num_heads: int = 8, ffnet_style: str = 'ff',
-                 dropout_p: float = 0.3, pad_id: int = 0) -> None:
+                 dropout_p: float = 0.3, pad_id: int = 0, native_layers: bool = False) -> None:
         super(TransformerDecoder, self).__init__()
         self.d_model = d_model
         self.num_layers = num_layers
         self.num_heads = num_heads
+        self.native_layers = native_layers
         self.embedding = Embedding(num_embeddings, pad_id, d_model)
-        self.pos_encoding = PositionalEncoding(d_model, dropout_p)
+        self.pos_encoding = PositionalEncoding(d_model)
         self.input_dropout = nn.Dropout(p=dropout_p)
-        self.layers = nn.ModuleList(
-            [TransformerDecoderLayer(d_model, num_heads, d_ff,  dropout_p, ffnet_style) for _ in range(num_layers)]
-        )
-        self.logit_scale = (d_model ** -0.5)
+        if native_layers:
+            self.layers = nn.TransformerDecoder(
+                nn.TransformerDecoderLayer(d_model, num_heads, d_ff, dropout_p,
+                                           activation='gelu', batch_first=True),
+                num_layers,
+            )
+        else:
+            self.layers = nn.ModuleList(
+                [TransformerDecoderLayer(d_model, num_heads, d_ff,  dropout_p, ffnet_style) for _ in range(num_layers)]
+            )
 
-    def forward(self, targets: Tensor,
-                input_lengths: Optional[Tensor] = None,
-                memory: Tensor = None) -> Tuple[Tensor, Tensor, Tensor]:
-        self_attns, memory_attns = list(), list()
+    @torch.compile(fullgraph=True, dynamic=True)
+    def _run_stack(self, output: Tensor, memory: Tensor, memory_mask: Optional[Tensor]) -> Tensor:
+        # Compiled as one graph so Inductor can fuse the residual-add / LayerNorm /
+        # activation kernels across layer boundaries and drop the per-layer dispatch cost.
+        for layer in self.layers:
+            output, _, _ = layer(output, memory, memory_mask)
+        return output
 
-        self_attn_mask = get_attn_pad_mask(targets, self.pad_id) | get_subsequent_mask(targets)
-        memory_mask = get_pad_mask(memory, input_lengths).squeeze(-1).unsqueeze(1).expand(-1, targets.size(1), -1)
+    def forward(self, targets: Tensor,
+                memory: Tensor = None,
+                memory_mask: Optional[Tensor] = None,
+                return_attns: bool = False) -> Tuple[Tensor, Tensor, Tensor]:
+        # The causal (subsequent) mask is applied inside the fused attention kernel via
+        # `is_causal=True`, so only the precomputed memory pad mask is threaded through.
+        # With right-padded targets the causal mask already covers trailing pad positions.
+        output = self.input_dropout(self.pos_encoding(targets.size(1)) + self.embedding(targets))
 
-        output = self.input_dropout(self.embedding(targets) * self.logit_scale + self.pos_encoding(targets.size(1)))
+        if self.native_layers:
+            assert not return_attns, "the native fast-path stack does not expose attention weights."
+            memory_key_padding_mask = None if memory_mask is None else memory_mask.reshape(memory.size(0), -1)
+            output = self.layers(output, memory,
+                                 tgt_mask=get_causal_mask(targets.size(1), targets.device), tgt_is_causal=True,
+                                 memory_key_padding_mask=memory_key_padding_mask)
+            return output, None, None
 
-        for layer in self.layers:
-            output, self_attn, memory_attn = layer(output, memory, self_attn_mask, memory_mask)
-            self_attns.append(self_attn)
-            memory_attns.append(memory_attn)
+        if return_attns:
+            # Eager fallback: the fused attention kernel cannot expose its weights,
+            # so the attention matrices are only materialized on explicit request.
+            self_attns, memory_attns = list(), list()
+            for layer in self.layers:
+                output, self_attn, memory_attn = layer(output, memory, memory_mask, need_weights=True)
+                self_attns.append(self_attn)
+                memory_attns.append(memory_attn)
+            return output, self_attns, memory_attns
 
-        return output, self_attns, memory_attns
+        output = self._run_stack(output, memory, memory_mask)
+        return output, None, None
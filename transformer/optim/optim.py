@@ -18,9 +18,21 @@ class Optimizer(object):
 
     def __init__(self, optim, max_grad_norm=0):
         self.optimizer = optim
+        self.sparse_optimizer = None
         self.scheduler = None
         self.max_grad_norm = max_grad_norm
 
+    def set_sparse_optimizer(self, sparse_optim):
+        """
+        Set a second optimizer for parameters with sparse gradients (e.g. SparseAdam
+        over nn.Embedding(sparse=True) weights), stepped alongside the main one.
+
+        Args:
+            sparse_optim (torch.optim.Optimizer): optimizer over the sparse-gradient
+               parameters, e.g. torch.optim.SparseAdam(embedding_params)
+        """
+        self.sparse_optimizer = sparse_optim
+
     def set_scheduler(self, scheduler):
         """
         Set the learning rate scheduler.
@@ -37,6 +49,15 @@ class Optimizer(object):
             params = itertools.chain.from_iterable([group['params'] for group in self.optimizer.param_groups])
             torch.nn.utils.clip_grad_norm_(params, self.max_grad_norm)
         self.optimizer.step()
+        # Sparse gradients are not norm-clipped; clip_grad_norm_ does not support them.
+        if self.sparse_optimizer is not None:
+            self.sparse_optimizer.step()
+
+    def zero_grad(self):
+        """ Clears the gradients of all optimized parameters. """
+        self.optimizer.zero_grad()
+        if self.sparse_optimizer is not None:
+            self.sparse_optimizer.zero_grad()
 
     def update(self, loss, epoch):
         """
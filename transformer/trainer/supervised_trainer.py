@@ -3,7 +3,7 @@ import os
 import random
 import torch
 import torchtext
-import torch.nn as nn
+import torch.nn.functional as F
 from torch import optim
 from transformer.optim.optim import Optimizer
 from transformer.checkpoint.checkpoint import Checkpoint
@@ -13,14 +13,16 @@ class SupervisedTrainer(object):
     """
     The SupervisedTrainer class helps in setting up a training framework in a supervised setting.
 
+    The training loss is cross entropy over the generator's raw logits, computed with
+    F.cross_entropy (a fused log_softmax + NLL with ignore_index on padding).
+
     Args:
         expt_dir (optional, str): experiment Directory to store details of the experiment,
             by default it makes a folder in the current directory to store the details (default: `experiment`).
-        loss (transformer.loss.loss.Loss, optional): loss for training, (default: seq2seq.loss.NLLLoss)
         batch_size (int, optional): batch size for experiment, (default: 64)
         checkpoint_every (int, optional): number of batches to checkpoint after, (default: 100)
     """
-    def __init__(self, expt_dir='experiment', criterion=nn.NLLLoss(), batch_size=64,
+    def __init__(self, expt_dir='experiment', batch_size=64,
                  random_seed=None,
                  checkpoint_every=100, print_every=100):
         self._trainer = "Simple Trainer"
@@ -28,7 +30,6 @@ class SupervisedTrainer(object):
         if random_seed is not None:
             random.seed(random_seed)
             torch.manual_seed(random_seed)
-        self.criterion = criterion
         self.optimizer = None
         self.checkpoint_every = checkpoint_every
         self.print_every = print_every
@@ -40,16 +41,47 @@ class SupervisedTrainer(object):
         self.batch_size = batch_size
         self.logger = logging.getLogger(__name__)
 
-    def _train_batch(self, inputs, targets, model):
-        criterion = nn.NLLLoss()
+    @staticmethod
+    def _build_default_optimizer(model):
+        # nn.Embedding(sparse=True) weights emit sparse gradients, which Adam does not
+        # accept, so they go into a SparseAdam group. A weight that is additionally tied
+        # into a dense module (e.g. the generator projection sharing the embedding
+        # matrix) accumulates dense gradients and therefore stays with Adam.
+        dense_owned = {id(p) for module in model.modules()
+                       if not isinstance(module, torch.nn.Embedding)
+                       for p in module.parameters(recurse=False)}
+        # Dedup by id: tied embeddings surface the same Parameter from several modules,
+        # and an optimizer must see each parameter exactly once.
+        sparse_params, sparse_ids = [], set()
+        for module in model.modules():
+            if isinstance(module, torch.nn.Embedding) and module.sparse:
+                for param in module.parameters(recurse=False):
+                    if id(param) not in dense_owned and id(param) not in sparse_ids:
+                        sparse_params.append(param)
+                        sparse_ids.add(id(param))
+        dense_params = [p for p in model.parameters() if id(p) not in sparse_ids]
+
+        optimizer = Optimizer(optim.Adam(dense_params), max_grad_norm=5)
+        if sparse_params:
+            optimizer.set_sparse_optimizer(optim.SparseAdam(sparse_params))
+        return optimizer
+
+    def _train_batch(self, inputs, input_lengths, targets, model):
+        # The decoder consumes the targets without their final token and the loss is
+        # computed against the targets shifted left by one. Plain slicing keeps the
+        # hot path free of boolean gathers (the model used to strip <eos> with a
+        # data-dependent mask on every forward, forcing a device sync per step).
+        decoder_inputs = targets[:, :-1]
         # Forward propagation
-        output, encoder_self_attns, decoder_self_attns, decoder_encoder_attns = model(inputs, targets)
-        # Get loss
-        loss = criterion(output.contiguous().view(-1, output.size(-1)), targets.contiguous().view(-1))
-        self.optimizer.optimizer.zero_grad()
-        loss.backward()
+        output = model(inputs, input_lengths, decoder_inputs)
+        # Get loss. The generator emits raw logits, so the fused log_softmax + NLL
+        # kernel of F.cross_entropy applies; padding positions are ignored.
+        loss = F.cross_entropy(output.contiguous().view(-1, output.size(-1)),
+                               targets[:, 1:].contiguous().view(-1),
+                               ignore_index=model.pad_id)
+        self.optimizer.zero_grad()
         # Backward propagation
-        model.zero_grad()
+        loss.backward()
         self.optimizer.step()
 
         return loss.item()
@@ -88,7 +120,7 @@ class SupervisedTrainer(object):
                 inputs, input_lengths = getattr(batch, 'src')
                 targets = getattr(batch, 'tgt')
 
-                loss = self._train_batch(inputs, targets, model)
+                loss = self._train_batch(inputs, input_lengths, targets, model)
 
                 # Record average loss
                 print_loss_total += loss
@@ -145,14 +177,10 @@ class SupervisedTrainer(object):
             latest_checkpoint_path = Checkpoint.get_latest_checkpoint(self.expt_dir)
             resume_checkpoint = Checkpoint.load(latest_checkpoint_path)
             model = resume_checkpoint.model
-            self.optimizer = resume_checkpoint.optimizer
-
-            # A walk around to set optimizing parameters properly
-            resume_optim = self.optimizer.optimizer
-            defaults = resume_optim.param_groups[0]
-            defaults.pop('params', None)
-            defaults.pop('initial_lr', None)
-            self.optimizer.optimizer = resume_optim.__class__(model.parameters(), **defaults)
+            # Rebuild the optimizer against the restored parameters with the same
+            # dense/sparse split used for fresh training; a plain Adam over
+            # model.parameters() would choke on the sparse embedding gradients.
+            self.optimizer = self._build_default_optimizer(model)
 
             start_epoch = resume_checkpoint.epoch
             step = resume_checkpoint.step
@@ -160,7 +188,7 @@ class SupervisedTrainer(object):
             start_epoch = 1
             step = 0
             if optimizer is None:
-                optimizer = Optimizer(optim.Adam(model.parameters()), max_grad_norm=5)
+                optimizer = self._build_default_optimizer(model)
             self.optimizer = optimizer
 
         self.logger.info("Optimizer: %s, Scheduler: %s" % (self.optimizer.optimizer, self.optimizer.scheduler))